@@ -13,14 +13,24 @@ Created: 10/24/17
 Updated: 10/26/17
 
 Notes: Updated create_region_w_spacing() to output to the terminal the number of rows,
-columns, total spots in the current region specified. In the future, might be cool to
-append another sheet to the pick list output that lists this information for each region
-being shot by that sheet, so post-processing the images is easier or something.
+columns, total spots in the current region specified. The script now also saves a spot
+map next to the pick list (RM_spotting_spot_map.npz) that has the region, row and column
+in that region's grid, source and volume of every spot, so post-processing the images
+can look spots up directly. The pick list is saved as csv, or as csv.gz or parquet
+with --format (python 1536_spotting_w_spacing.py --format csv.gz).
 
 """
 
 import pandas as pd
+import numpy as np
 import os
+import sys
+import json
+import argparse
+
+#The pick list writers are shared with the other Echo scripts, they live in echo_workspace.py next to this one
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from echo_workspace import PICK_LIST_BACKENDS, write_pick_list
 
 class plate1536:
     """Holds all the column and row values about 1536 well plates"""
@@ -36,6 +46,12 @@ class plate1536:
     for i in range(len(rows)):
         row_dict[i] = rows[i]
 
+    #and the other way around, so each row's number is a dict lookup instead of a search through rows
+    row_index = {}
+
+    for i in range(len(rows)):
+        row_index[rows[i]] = i
+
     #all the columns in a 1563 well plate (48 of them)
     columns = [i+1 for i in range(48)]
 
@@ -107,10 +123,21 @@ def create_region_w_spacing (tuple_top_L, tuple_bottom_R):
     """User inputs desired spacing between spots. Uses column and row from top left
     well location to create 2 lists of columns and rows that increment by the
     desired number of spaces between them. These can be combined to make a rectangular
-    grid with the desired spacing in between each spot in x and y directions."""
+    grid with the desired spacing in between each spot in x and y directions.
+    Returns the rows, the columns and the spacing, so the region can be saved as a template."""
 
     spacing = int(input ('How many well spaces do you want between each spot?   '))
 
+    row_strs, col_strs = region_w_spacing (tuple_top_L, tuple_bottom_R, spacing)
+
+    return row_strs, col_strs, spacing
+
+
+def region_w_spacing (tuple_top_L, tuple_bottom_R, spacing):
+
+    """Does the work for create_region_w_spacing() once the spacing is known, so a
+    region can also be made without asking anything (e.g. from a saved template)"""
+
 
     #get the plate column numbers from the plate class
     columns = plate1536.columns
@@ -177,6 +204,62 @@ def create_region_w_spacing (tuple_top_L, tuple_bottom_R):
     return row_strs, col_strs
 
 
+#File in the current working directory where spotting templates are saved between runs
+TEMPLATE_FILE = 'spotting_templates.json'
+
+#Templates already read from (or saved to) each template file this session, file -> {name: template}
+template_cache = {}
+
+
+def load_templates (template_file=TEMPLATE_FILE):
+
+    """Gets all the saved templates as a dict of name -> template. The file is only
+    read the first time, after that the templates come from template_cache"""
+
+    if template_file not in template_cache:
+        if os.path.isfile(template_file):
+            with open(template_file) as f:
+                template_cache[template_file] = json.load(f)
+        else:
+            template_cache[template_file] = {}
+
+    return template_cache[template_file]
+
+
+def get_template (name, template_file=TEMPLATE_FILE):
+
+    """Looks up a saved template by name. A template is a dict holding the region's
+    'wells' list (ready to shoot), its 'rows' and 'columns', and the 'top_left',
+    'bottom_right' and 'spacing' it was made from"""
+
+    templates = load_templates(template_file)
+
+    if name not in templates:
+        raise ValueError('There is no spotting template called {}. Saved templates are: {}'.format(name, sorted(templates)))
+
+    return templates[name]
+
+
+def save_template (name, tuple_top_L, tuple_bottom_R, spacing, row_strs, col_strs, template_file=TEMPLATE_FILE):
+
+    """Saves a region under a name, both in memory and in the template file, so the
+    same layout can be reused later without regenerating or checking it again"""
+
+    templates = load_templates(template_file)
+
+    templates[name] = {'top_left' : ''.join(tuple_top_L),
+                       'bottom_right' : ''.join(tuple_bottom_R),
+                       'spacing' : spacing,
+                       'rows' : row_strs,
+                       'columns' : col_strs,
+                       'wells' : well_list_from_region(row_strs, col_strs)}
+
+    with open(template_file, 'w') as f:
+        json.dump(templates, f, indent=1)
+
+    return templates[name]
+
+
 def well_list_from_region (row_strs, col_strs):
 
     """Makes a single list of wells of format 'AA##' that represent the destination
@@ -208,24 +291,156 @@ def add_source_and_vol (well_list):
 
 
 
+def gradient_sources_and_vols (row_strs, col_strs, sources, vols, sources_along='rows'):
+
+    """Makes a gradient/matrix region: each source goes down one axis of the region
+    (one source per row, or per column) and each volume step along the other axis, so
+    every spot gets its own source and volume. All the spots are made in one go with
+    numpy. Returns (sources, vols, well_list) with one source and volume per well, in
+    the same order as well_list_from_region()"""
+
+    n_rows = len(row_strs)
+    n_cols = len(col_strs)
+
+    sources = np.asarray(sources, dtype=object)
+    vols = np.asarray(vols, dtype=int)
+
+    if sources_along == 'rows':
+        src_axis, vol_axis = n_rows, n_cols
+    elif sources_along == 'columns':
+        src_axis, vol_axis = n_cols, n_rows
+    else:
+        raise ValueError("sources_along has to be 'rows' or 'columns'")
+
+    if len(sources) != src_axis or len(vols) != vol_axis:
+        raise ValueError('This region is {} rows by {} columns, you need {} sources and {} volumes, not {} and {}.'\
+                         .format(n_rows, n_cols, src_axis, vol_axis, len(sources), len(vols)))
+
+    #check all the volumes against the Echo's 25 nL drops at once
+    bad_vols = vols[vols % 25 != 0]
+    if len(bad_vols):
+        raise ValueError('The volumes {} are not compatible with the Echo, please enter multiples of 25 nL.'.format(list(bad_vols)))
+
+    #wells go row by row, so anything that changes with the row is repeated across the row
+    #and anything that changes with the column is tiled down the rows
+    wells = np.char.add(np.repeat(np.asarray(row_strs, dtype=str), n_cols), np.tile(np.asarray(col_strs, dtype=str), n_rows))
+
+    if sources_along == 'rows':
+        spot_sources = np.repeat(sources, n_cols)
+        spot_vols = np.tile(vols, n_rows)
+    else:
+        spot_sources = np.tile(sources, n_rows)
+        spot_vols = np.repeat(vols, n_cols)
+
+    return (list(spot_sources), list(spot_vols), list(wells))
+
+
+def add_gradient_sources_and_vols (row_strs, col_strs):
+
+    """Ask the user for the list of source wells and the list of volume steps for a
+    gradient/matrix region, and which way the sources should go"""
+
+    along = input('Should each source get its own row or its own column? (r/c)   ')
+
+    sources_along = 'columns' if along in ['c', 'C'] else 'rows'
+
+    sources = [src.strip() for src in input('List the source wells, in order, separated by commas:   ').split(',')]
+
+    vols = [int(vol) for vol in input('List the volume steps (nL), in order, separated by commas:   ').split(',')]
+
+    return gradient_sources_and_vols (row_strs, col_strs, sources, vols, sources_along)
+
+
+def well_indices (well_list):
+
+    """Turns a list of well names into numpy arrays of their row and column
+    numbers (0 indexed), for looking wells up in a plate occupancy map"""
+
+    row_idxs = np.empty(len(well_list), dtype=int)
+    col_idxs = np.empty(len(well_list), dtype=int)
+
+    for i, well in enumerate(well_list):
+        letters, nums = split_well_name(well)
+        row_idxs[i] = plate1536.row_index[letters]
+        col_idxs[i] = int(nums) - 1
+
+    return row_idxs, col_idxs
+
+
+def new_occupancy ():
+
+    """A 32 x 48 map of a 1536 well plate, True for every well that will get shot"""
+
+    return np.zeros((len(plate1536.rows), len(plate1536.columns)), dtype=bool)
+
+
+def add_to_occupancy (occupancy_maps, well_list, dest_plate='Destination[1]', allow_overlap=False):
+
+    """Marks a region's wells in the occupancy map of its destination plate (maps
+    are kept in a dict of plate name -> map). Returns the wells that were already
+    going to be shot. If there are any, the region isn't marked unless allow_overlap
+    is True. Only looks at the region's own wells, no matter how full the plate is"""
+
+    occupancy = occupancy_maps.setdefault(dest_plate, new_occupancy())
+
+    row_idxs, col_idxs = well_indices(well_list)
+
+    already = occupancy[row_idxs, col_idxs]
+    overlaps = [well for well, hit in zip(well_list, already) if hit]
+
+    if overlaps and not allow_overlap:
+        return overlaps
+
+    occupancy[row_idxs, col_idxs] = True
+
+    return overlaps
+
+
+def occupancy_stats (occupancy_maps):
+
+    """How full each destination plate is: dict of plate name -> spots, empty
+    wells, fraction of the plate filled, and how many rows and columns get used"""
+
+    stats = {}
+
+    for plate, occupancy in occupancy_maps.items():
+        spots = int(occupancy.sum())
+        stats[plate] = {'spots' : spots,
+                        'empty wells' : occupancy.size - spots,
+                        'fraction filled' : spots / float(occupancy.size),
+                        'rows used' : int(occupancy.any(axis=1).sum()),
+                        'columns used' : int(occupancy.any(axis=0).sum())}
+
+    return stats
+
+
 def make_echo_csv (list_of_region_tuples):
 
-    """Compiles all the information into a dataframe in correct Echo input format"""
+    """Compiles all the information into a dataframe in correct Echo input format.
+    Each region tuple's source and volume can either be one value for the whole
+    region or a list with one value per well (from gradient_sources_and_vols())"""
 
-    #initialize the Echo formatted output dataframe
-    out = pd.DataFrame(columns= ['Source Plate Name', 'Source Plate Type', 'Source Well', 'Sample ID', 'Sample Name', \
-                                 'Sample Group', 'Sample Comment', 'Destination Plate Name', 'Destination Well', 'Transfer Volume'])
+    sources = []
+    vols = []
+    wells = []
 
-    idx = 0 #have to use a counter because we go through multiple lists and can't return to idx=0 each time
     #there may be a list of region tuples with source wells, volumes, dest wells
     for region in list_of_region_tuples:
-        #for each well location to be shot from the current region
-        for well in region[2]:
-            #add the dest well
-            out.loc[idx, 'Destination Well'] = well
-            #Add the source well and transfer volume for that region
-            out.loc[idx, ['Source Well', 'Transfer Volume']] = [region[0], region[1]]
-            idx += 1
+        n = len(region[2])
+        #broadcasting turns a single source/volume into one per well and leaves per-well lists alone
+        sources.append(np.broadcast_to(np.asarray(region[0], dtype=object), (n,)))
+        vols.append(np.broadcast_to(np.asarray(region[1]), (n,)))
+        wells.append(np.asarray(region[2], dtype=object))
+
+    #initialize the Echo formatted output dataframe, all the rows at once
+    out = pd.DataFrame(columns= ['Source Plate Name', 'Source Plate Type', 'Source Well', 'Sample ID', 'Sample Name', \
+                                 'Sample Group', 'Sample Comment', 'Destination Plate Name', 'Destination Well', 'Transfer Volume'],
+                       index = range(sum(len(w) for w in wells)))
+
+    if wells:
+        out['Source Well'] = np.concatenate(sources)
+        out['Destination Well'] = np.concatenate(wells)
+        out['Transfer Volume'] = np.concatenate(vols)
 
     #Set the unchanging names for the dataframe
     out[['Source Plate Name', 'Source Plate Type', 'Destination Plate Name']] = ['Source[1]', '384PP_AQ_BP', 'Destination[1]']
@@ -233,32 +448,147 @@ def make_echo_csv (list_of_region_tuples):
     return out
 
 
-def main ():
+def make_spot_map (list_of_region_tuples):
+
+    """One row per spot: the destination well, its row and column number on the plate
+    (0 indexed), which region it's in (0 indexed, in the order the regions were added),
+    its row and column in that region's grid of spots, and its source well and volume"""
+
+    maps = []
+
+    for region_id, region in enumerate(list_of_region_tuples):
+        wells = list(region[2])
+        n = len(wells)
+
+        row_idxs, col_idxs = well_indices(wells)
+
+        #a spot's place in the grid is how many of the region's rows (columns) come before its own
+        grid_rows = np.unique(row_idxs, return_inverse=True)[1]
+        grid_cols = np.unique(col_idxs, return_inverse=True)[1]
+
+        maps.append(pd.DataFrame({'Destination Well' : wells,
+                                  'plate row' : row_idxs,
+                                  'plate column' : col_idxs,
+                                  'region' : np.full(n, region_id),
+                                  'grid row' : grid_rows,
+                                  'grid column' : grid_cols,
+                                  'Source Well' : np.broadcast_to(np.asarray(region[0], dtype=object), (n,)),
+                                  'Transfer Volume' : np.broadcast_to(np.asarray(region[1]), (n,))}))
+
+    spot_map_cols = ['Destination Well', 'plate row', 'plate column', 'region', 'grid row', 'grid column', 'Source Well', 'Transfer Volume']
+
+    if not maps:
+        return pd.DataFrame(columns = spot_map_cols)
+
+    return pd.concat(maps, ignore_index=True)[spot_map_cols]
+
+
+def write_spot_map (spot_map, file_name):
+
+    """Saves the spot map. A .parquet file name saves the table as Parquet (needs pyarrow
+    or fastparquet installed). Anything else is saved as a numpy .npz file holding each
+    column of the table as an array, plus 32 x 48 plate shaped arrays (plate_region,
+    plate_grid_row, plate_grid_column, plate_volume, plate_source) so a spot's info is
+    just array[row, column]. Empty wells are -1 (0 volume, '' source)"""
+
+    if file_name.endswith('.parquet'):
+        spot_map.to_parquet(file_name, index=False)
+        return None
+
+    shape = (len(plate1536.rows), len(plate1536.columns))
+    rows = spot_map['plate row'].values.astype(int)
+    cols = spot_map['plate column'].values.astype(int)
+
+    arrays = {}
+    for col in spot_map.columns:
+        arrays[col.replace(' ', '_')] = spot_map[col].values.astype(str if col in ['Destination Well', 'Source Well'] else int)
+
+    for col, name, empty in [('region', 'plate_region', -1), ('grid row', 'plate_grid_row', -1),
+                             ('grid column', 'plate_grid_column', -1), ('Transfer Volume', 'plate_volume', 0)]:
+        plate = np.full(shape, empty, dtype=int)
+        plate[rows, cols] = spot_map[col].values.astype(int)
+        arrays[name] = plate
+
+    plate_source = np.full(shape, '', dtype=object)
+    plate_source[rows, cols] = spot_map['Source Well'].values
+    arrays['plate_source'] = plate_source.astype(str)
+
+    np.savez_compressed(file_name, **arrays)
+
+    return None
+
+
+def main (out_format='csv'):
+
+    """out_format is 'csv', 'csv.gz' or 'parquet' (the Echo software itself needs csv)"""
+
     more = 'y'
 
     all_infos = []
+
+    #which wells of the destination plate are already going to be shot
+    occupancy = {}
+
     while more in ['y', 'Y']:
-        tl, br = get_corners()
+        template_name = input('Type the name of a saved spotting template to use, or just press enter to define a new region:   ').strip()
+
+        if template_name:
+            #saved layouts were already checked when they were made
+            template = get_template(template_name)
+            row, col, wells = template['rows'], template['columns'], template['wells']
+            print("Using template {}, that's a total of {} spots".format(template_name, len(wells)))
+        else:
+            tl, br = get_corners()
+
+            check_orient (tl, br)
 
-        check_orient (tl, br)
+            row, col, spacing = create_region_w_spacing (tl, br)
 
-        row, col = create_region_w_spacing (tl, br)
+            wells = well_list_from_region (row, col)
 
-        wells = well_list_from_region (row, col)
+            save_name = input('Type a name to save this region as a template, or just press enter to skip:   ').strip()
+            if save_name:
+                save_template (save_name, tl, br, spacing, row, col)
 
-        region_info = add_source_and_vol (wells)
+        #shooting the same well twice is almost never on purpose, so don't take overlapping regions
+        overlaps = add_to_occupancy (occupancy, wells)
+        if overlaps:
+            print('This region overlaps wells that are already being shot: {}. It was not added.'.format(overlaps))
+            more = input('Is there another region into which you would like to shoot spots? (y/n)   ')
+            continue
+
+        gradient = input('Is this a gradient/matrix region (different sources and volumes across it)? (y/n)   ')
+
+        if gradient in ['y', 'Y']:
+            region_info = add_gradient_sources_and_vols (row, col)
+        else:
+            region_info = add_source_and_vol (wells)
 
         all_infos.append(region_info)
 
         more = input('Is there another region into which you would like to shoot spots? (y/n)   ')
 
+    for plate, stats in occupancy_stats(occupancy).items():
+        print('{} gets {} spots ({:.1%} of the plate) over {} rows and {} columns'\
+              .format(plate, stats['spots'], stats['fraction filled'], stats['rows used'], stats['columns used']))
+
     output = make_echo_csv (all_infos)
 
-    output.to_csv(os.getcwd() + '\\RM_spotting_output.csv', index=False)
+    out_name = 'RM_spotting_output.' + out_format
+
+    write_pick_list (output, out_name)
 
-    print("Your pick list is saved in the working directory as 'RM_spotting_output.csv' ")
+    print("Your pick list is saved in the working directory as '{}' ".format(out_name))
+
+    write_spot_map (make_spot_map(all_infos), 'RM_spotting_spot_map.npz')
+
+    print("The spot map for image analysis is saved as 'RM_spotting_spot_map.npz' ")
 
     return None
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Make an Echo pick list for spotting regions of a 1536 well plate, everything else gets asked as it goes')
+    parser.add_argument('--format', default='csv', choices=sorted(PICK_LIST_BACKENDS), help='how to save the pick list (the Echo needs csv)')
+    args = parser.parse_args()
+
+    main(args.format)
@@ -20,9 +20,23 @@ I just made it look directly in the current working directory for everything.
 It is capable of finding each kind of file regardless of all the junk that may be
 in the current directory. It works pretty great! Has been tested in powershell
 and works from there.
+
+Options (python MoCloAssy.py --help lists them): --incremental only recalculates
+the target wells whose assembly rows changed since the last run, --delta (with
+--incremental) writes just those to the pick list, --processes runs the checks
+on processes instead of threads and --format picks csv, csv.gz or parquet.
 """
 #Handles finding the files to be used in the script
 import os
+import sys
+
+#Handles the command line options
+import argparse
+
+#list_files and the pick list writers are shared with the other Echo scripts, they live in echo_workspace.py
+#in the folder above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from echo_workspace import list_files, PICK_LIST_BACKENDS, write_pick_list
 
 #Handles any operations we might do with lists and stuff
 import numpy as np
@@ -30,6 +44,12 @@ import numpy as np
 #Handles our matrices and file i/o
 import pandas as pd
 
+#Handles fingerprinting assembly rows for incremental pick list regeneration
+import hashlib
+
+#Handles reading several library workbooks and running the checks at the same time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 
 
 """Begin block of functions for getting the part library and assembly files"""
@@ -40,25 +60,25 @@ def find_part_libraries_RM ():
     #Get name of directory where the current script, along with all other library and assembly files, lives
     currdir = os.getcwd()
 
-    #go through all the items in this directory, files, folders, everything, then save only items that are files
-    onlyfiles = [item for item in os.listdir(currdir) if os.path.isfile(currdir + '\\' + item)]
+    #get all the files (not folders) in this directory, as (file name, full path) pairs
+    onlyfiles = list_files(currdir)
 
     #initialize list of possible library files
     libs = []
 
-    for file in onlyfiles:
+    for file, filepath in onlyfiles:
         #if file is an xlsx file (which library files should be)
         if(file[-4:]=='xlsx'):
 
             #read the excel file as a dictionary
             #with each sheetname generating a key for the dict to access each sheet individually
-            xl_file = pd.read_excel(currdir + '\\' + file, sheetname=None)
+            xl_file = pd.read_excel(filepath, sheet_name=None)
 
             #check each sheet in that excel file
             for key in xl_file.keys():
                 #check if the column labels 'part' and 'well' are in this sheet, if so, file is probably a library
                 if ('part' in xl_file[key].columns and 'well' in xl_file[key].columns):
-                    libs+=[('{}\\{}'.format(currdir, file), file[:-5])]
+                    libs+=[(filepath, file[:-5])]
 
     return sorted(libs)[::-1]
 
@@ -80,12 +100,12 @@ def find_part_libraries_ASS (path):
         #if file is an xlsx file (which library files should be)
         if(file[-4:]=='xlsx'):
             #read the excel file as a dictionary with key = sheetname
-            xl_file = pd.read_excel(dirlist[1][0]+'\\'+file, sheetname=None)
+            xl_file = pd.read_excel(os.path.join(dirlist[1][0], file), sheet_name=None)
 
             for key in xl_file.keys():
                 #check if the column labels 'part' and 'well' are in this sheet, if so, it's probably a library
                 if ('part' in xl_file[key].columns and 'well' in xl_file[key].columns):
-                    libs+=[('{}\\{}'.format(dirlist[1][0], file), file[:-4])]
+                    libs+=[(os.path.join(dirlist[1][0], file), file[:-4])]
 
     return sorted(libs)[::-1]
 
@@ -95,23 +115,23 @@ def find_assemblies_RM ():
     #Get name of directory where the current script, along with all other library and assembly files, lives
     currdir = os.getcwd()
 
-    #go through all the items in this directory, files, folders, everything, then save only items that are files
-    onlyfiles = [item for item in os.listdir(currdir) if os.path.isfile(currdir + '\\' + item)]
+    #get all the files (not folders) in this directory, as (file name, full path) pairs
+    onlyfiles = list_files(currdir)
 
     #initialize list of possible assembly files
     assys = []
 
-    for file in onlyfiles:
+    for file, filepath in onlyfiles:
         #if file is a csv, which assemblies should be
         if(file[-3:] =='csv'):
 
             #try to do the following stuff, except pass on an IOError from pd.read_csv
             try:
-                assy_csv = pd.read_csv(currdir + '\\' + file)
+                assy_csv = pd.read_csv(filepath)
 
                 #check if the column labels 'promoter' and 'targwell' are in this df, if so, file is probably an assembly
                 if ('promoter' in assy_csv.columns and 'targwell' in assy_csv.columns):
-                    assys+=[('{}\\{}'.format(currdir, file), file[:-4])]
+                    assys+=[(filepath, file[:-4])]
             except IOError:
                 pass
     return sorted(assys)[::-1]
@@ -131,11 +151,11 @@ def find_assemblies_ASS (path):
         #if file is a csv, which assemblies should be
         if(file[-3:] =='csv'):
             try:
-                assy_csv = pd.read_csv(path + '\\' + file)
+                assy_csv = pd.read_csv(os.path.join(path, file))
 
                 #check if the column labels 'promoter' and 'targwell' are in this df, if so, it's probably an assembly
                 if ('promoter' in assy_csv.columns and 'targwell' in assy_csv.columns):
-                    assys+=[('{}\\{}'.format(path, file), file[:-4])]
+                    assys+=[(os.path.join(path, file), file[:-4])]
             except IOError:
                 pass
     return sorted(assys)[::-1]
@@ -171,13 +191,15 @@ def pick_parts_library ():
 
         if(len(partLibList) == 1):
             #choose the first and only entry in the libraries list
-            #set pickedlist to be the PATH (not the shortened filename) of that library
-            pickedlist = partLibList[0][0]
+            #keep the whole (path, short filename) tuple, the short name becomes the plate name
+            pickedlist = [partLibList[0]]
             print ('picked the only one in the list!')
         else:
-            userpick = input('type the number of the one you want.   ')
-            pickedlist = partLibList[int(userpick)][0]
-    openlist = pd.read_excel(pickedlist)
+            #parts can be spread over several library plates, so allow picking more than one
+            userpick = input('type the number of the one you want (or several numbers separated by commas).   ')
+            pickedlist = [partLibList[int(num)] for num in userpick.split(',')]
+
+    openlist = merge_libraries(load_libraries(pickedlist))
 
     print ("===================================")
     return openlist
@@ -215,14 +237,120 @@ def pick_assembly ():
             userpick = input('type the number of the one you want.   ')
             pickedlist = assyList[int(userpick)][0]
 
-    openlist = pd.read_csv(pickedlist)
-
-    openlist = openlist.dropna(axis=0, how='all')
+    openlist = read_assembly(pickedlist)
     print ("===================================")
     return openlist
 """end library and assembly file choosing and opening"""
 
 
+"""Begin functions for combining several parts libraries"""
+#Separates the library plate name from the well once several libraries are merged, e.g. 'lib plate 2:A1'
+PLATE_SEP = ':'
+
+#Read several library files concurrently. Takes a list of (path, short filename) tuples like
+#find_part_libraries_RM() returns and gives back a list of (short filename, library df) tuples
+def load_libraries (lib_list):
+
+    with ThreadPoolExecutor(max_workers=len(lib_list)) as pool:
+        frames = list(pool.map(pd.read_excel, [lib[0] for lib in lib_list]))
+
+    return [(lib[1], frame) for lib, frame in zip(lib_list, frames)]
+
+#Stack several libraries into one library df. With only one library nothing changes. With more than one,
+#the 'well' column becomes 'plate:well' so that every other function can keep looking parts up by 'well'
+#without mixing up A1 on one plate with A1 on another. The plate name and plain well are kept in their own columns.
+def merge_libraries (named_libs):
+
+    if len(named_libs) == 1:
+        return named_libs[0][1]
+
+    frames = []
+    for name, library in named_libs:
+        library = library.copy()
+        library['plate'] = name
+        library['plate well'] = library['well']
+        library['well'] = name + PLATE_SEP + library['well'].astype(str)
+        frames.append(library)
+
+    return pd.concat(frames, ignore_index=True)
+
+#Split a library 'well' key into the Echo source plate name and the well on that plate
+def split_library_key (key):
+
+    if PLATE_SEP in str(key):
+        plate, well = str(key).split(PLATE_SEP, 1)
+        return plate, well
+    else:
+        return 'Source[1]', key
+
+#Build a dict that resolves whatever the assembly file uses to refer to a part to
+#(library key, plate, conc, volume) in one lookup. The full 'plate:well' key, the plain well and
+#the part name from the library 'part' column all work. A plain well or part name that points at
+#more than one library well is ambiguous, and maps to the list of keys it could mean instead.
+def build_library_index (library_df):
+    library = library_df
+
+    index = {}
+    plain_wells = {}
+    part_names = {}
+
+    for key, name, conc, vol in zip(library['well'], library['part'], library['conc (nM)'], library['Vol (uL) in plate']):
+        plate, well = split_library_key(key)
+
+        index[key] = (key, plate, conc, vol)
+        plain_wells.setdefault(well, []).append(key)
+
+        if not pd.isnull(name):
+            part_names.setdefault(name, []).append(key)
+
+    #wells win over part names if a part happens to be named like a well
+    for aliases in [plain_wells, part_names]:
+        for alias, keys in aliases.items():
+            if alias not in index:
+                index[alias] = index[keys[0]] if len(keys) == 1 else keys
+
+    return index
+
+#Rewrite every part in the assembly (given by well or by part name) to its library key using the
+#index so the rest of the script can find it. Raises an error listing any parts that can't be found
+#and any that are ambiguous, along with the wells they could be.
+def qualify_assembly (assembly_df, library_index):
+    assemblies = assembly_df.copy()
+    index = library_index
+
+    parts = [col for col in list(assemblies.columns) if col not in ['comment', 'targwell']]
+
+    missing = []
+    ambiguous = []
+    resolved = {}
+
+    #only look up each different part once, no matter how many assemblies use it
+    for part in pd.unique(assemblies[parts].values.ravel()):
+        if pd.isnull(part):
+            continue
+        if part not in index:
+            missing.append(part)
+        elif isinstance(index[part], list):
+            ambiguous.append('{} (could be {})'.format(part, ', '.join(index[part])))
+        else:
+            resolved[part] = index[part][0]
+
+    errs = []
+    if missing:
+        errs.append('The requested parts {} are not in any library file'.format(missing))
+    if ambiguous:
+        errs.append('The requested parts {} match more than one library well, use the well or plate{}well it should come from instead'\
+                    .format(ambiguous, PLATE_SEP))
+    if errs:
+        raise ValueError('***{}***'.format('. '.join(errs)))
+
+    for col in parts:
+        assemblies[col] = [resolved.get(part, part) if not pd.isnull(part) else part for part in assemblies[col]]
+
+    return assemblies
+"""end functions for combining several parts libraries"""
+
+
 """Begin functions for creating the Echo output"""
 #Transform the assembly input format into a df of pairs ['part', 'target'] that will get added to later
 #Is not called on its own, is called during execution of other functions
@@ -301,7 +429,7 @@ def add_water_transfers (part_transfer_list_df, library_df):
         #Find out how much water is needed to get to ~4uL (all volumes handled here are in nL)
         if volSum < 4000:
             waterTrans = round( (4000 - volSum) / 25) * 25
-        elif volSum == 4000: #just in case, the other exception of transfer vols exceeding 4000 is already handled in check_vol_errors
+        else: #volSum == 4000, or more than 4000, which gets reported by check_all
             waterTrans = 0
 
         #Get well that has the water
@@ -325,35 +453,56 @@ def make_echo_csv (part_plus_water_transfers_df):
                                  'Sample Group', 'Sample Comment', 'Destination Plate Name', 'Destination Well', 'Transfer Volume'])
 
     for idx, row in transfers.iterrows(): #loops over the index and a Series of data for each row, which can be sliced by column name
-        out.loc[idx, 'Source Well'] = row['part']
+        #parts from merged libraries carry their plate name in the key, single libraries are always 'Source[1]'
+        out.loc[idx, ['Source Plate Name', 'Source Well']] = split_library_key(row['part'])
         out.loc[idx, 'Destination Well'] = row['target']
         out.loc[idx, 'Transfer Volume'] = row['volume']
 
-    out[['Source Plate Name', 'Source Plate Type', 'Destination Plate Name']] = ['Source[1]', '384PP_AQ_BP', 'Destination[1]']
+    out[['Source Plate Type', 'Destination Plate Name']] = ['384PP_AQ_BP', 'Destination[1]']
 
     return out
 """end functions for making echo-formatted output"""
 
 
 
+
+
 """Begin functions for checking things in the process of making the echo output"""
+#Each check has a find_ function that returns the list of offending wells and a check_ function
+#that raises an error if that list has anything in it. The find_ functions only need to see the
+#rows for the wells they report on, which is what lets run_validations split them up.
+#main runs them all at once with check_all, the check_ functions are for running one check on its own.
+
+#check name -> what the error says about the wells it found, shared by the check_ functions and check_all
+#so they always say the same thing (the not enough volume errors are worded by raise_enough_vol_errors)
+CHECK_MESSAGES = {
+    'not in library' : 'The requested parts in wells {} are not in the library file',
+    'parts over 4uL' : 'Sum of transfer volumes into destination wells {} is greater than 4uL',
+    'final volume not 4uL' : 'The wells {} will not have 4uL (parts + water) transferred to them',
+}
+
+#Find requested parts (in a transfers df) that are not in the library file
+def find_lib_errors (transfers_df, library_df):
+
+    #set of library keys so each membership check is a hash lookup instead of a scan of the library
+    lib_wells = set(library_df['well'].values)
+
+    return [part for part in np.unique(transfers_df['part']) if part not in lib_wells]
+
 #Check if requested parts are in the library file
 def check_if_in_lib (assembly_df, library_df):
 
     part_target_pairs = make_part_target_pairs(assembly_df)
 
-    liberrs = []
+    liberrs = find_lib_errors(part_target_pairs, library_df)
 
-    for part in np.unique(part_target_pairs['part']):
-        if part not in library_df['well'].values:
-            liberrs.append(part)
     if liberrs:
-        raise ValueError('***The requested parts in wells {} are not in the library file***'.format(liberrs))
+        raise ValueError('***{}***'.format(CHECK_MESSAGES['not in library'].format(liberrs)))
     else:
         return None
 
-#Checks for total transfer volumes that exceed 4uL
-def check_vol_errors (part_transfer_list_df):
+#Find destination wells where the part transfers alone exceed 4uL
+def find_vol_errors (part_transfer_list_df):
     transfers = part_transfer_list_df
 
     #Initialize the list of destination wells where transfers exceed 4uL
@@ -367,15 +516,21 @@ def check_vol_errors (part_transfer_list_df):
         if sum(vols.values) > 4000:
             volerrs.append(targwell)
 
+    return volerrs
+
+#Checks for total transfer volumes that exceed 4uL
+def check_vol_errors (part_transfer_list_df):
+
+    volerrs = find_vol_errors(part_transfer_list_df)
+
     #if the list of destination well errors has entries (is True), raise an error that lists them
     if volerrs:
-        raise ValueError('***Sum of transfer volumes into destination wells {} is greater than 4uL***'.format(volerrs))
+        raise ValueError('***{}***'.format(CHECK_MESSAGES['parts over 4uL'].format(volerrs)))
     else:
         return None
 
-#Check the library file to see if there is enough volume of each part
-#available to complete the requested transfers
-def check_enough_vol (part_plus_water_transfers_df, library_df):
+#Find source wells in the library that don't have enough volume for the requested transfers
+def find_enough_vol_errors (part_plus_water_transfers_df, library_df):
     transfers = part_plus_water_transfers_df
     library = library_df
 
@@ -395,8 +550,14 @@ def check_enough_vol (part_plus_water_transfers_df, library_df):
         if (currVol - totalTrans) < 17:
             volErr.append(part)
 
-        #find water well
-        waterwell = library.loc[library['part'] == 'WATER', 'well'].values[0]
+    return volErr
+
+#Raise the right error for the source wells that don't have enough volume, calling out the water well separately
+def raise_enough_vol_errors (volErr, library_df):
+    library = library_df
+
+    #find water well
+    waterwell = library.loc[library['part'] == 'WATER', 'well'].values[0]
 
     #if volErr has entries and waterwell is one of them
     if volErr and (waterwell in volErr):
@@ -404,11 +565,8 @@ def check_enough_vol (part_plus_water_transfers_df, library_df):
         #if there is more than 1 entry in volErr, meaning there are part errors beyond the waterwell.
         if len(volErr) > 1:
 
-            #get index of the water well in volErr
-            k = volErr.index('A10')
-
             #construct list that just has the remaining part errors
-            parterrs = volErr[:k] + volErr[(k + 1):]
+            parterrs = [part for part in volErr if part != waterwell]
 
             raise ValueError('***Part wells {} do not have enough volume in them. Additionally, water well {} does not have enough volume***'\
                   .format(parterrs, waterwell))
@@ -425,9 +583,14 @@ def check_enough_vol (part_plus_water_transfers_df, library_df):
     else:
         return None
 
-#Check the final output document to make sure the total transfer volumes are
-#4uL
-def check_if_final_vols_ok (output_df):
+#Check the library file to see if there is enough volume of each part
+#available to complete the requested transfers
+def check_enough_vol (part_plus_water_transfers_df, library_df):
+
+    return raise_enough_vol_errors(find_enough_vol_errors(part_plus_water_transfers_df, library_df), library_df)
+
+#Find destination wells in the final output that don't add up to 4uL
+def find_final_vol_errors (output_df):
 
     desired_total_volume = 4000 #in nL, this is 4uL
 
@@ -435,61 +598,336 @@ def check_if_final_vols_ok (output_df):
 
     for targwell in np.unique(output_df['Destination Well']):
 
-        vols = output_df.loc[ output_df['Destination Well'] == 'A4', 'Transfer Volume' ]
+        vols = output_df.loc[ output_df['Destination Well'] == targwell, 'Transfer Volume' ]
 
         if sum(vols) != desired_total_volume:
             final_vol_errs.append(targwell)
 
+    return final_vol_errs
+
+#Check the final output document to make sure the total transfer volume into every well is
+#exactly 4uL, too little is as bad as too much
+def check_if_final_vols_ok (output_df):
+
+    final_vol_errs = find_final_vol_errors(output_df)
+
     if final_vol_errs:
-        raise ValueError('***The wells {} will have more than 4uL (parts + water) transferred to them***'.format(final_vol_errs))
+        raise ValueError('***{}***'.format(CHECK_MESSAGES['final volume not 4uL'].format(final_vol_errs)))
+    else:
+        return None
+
+#Split a df into n_shards pieces so that all the rows for any one well (in well_col) land in the same piece.
+#Wells are sorted first so the shards, and everything merged from them, always come out in the same order.
+def shard_by_well (df, well_col, n_shards):
+
+    wells = np.unique(df[well_col])
+
+    return [df.loc[df[well_col].isin(group)] for group in np.array_split(wells, n_shards) if len(group)]
+
+#Run all the independent checks on a finished set of transfers at once, on a pool of threads (or processes
+#with use_processes=True). Destination checks are split up by destination well and source checks by source well.
+#Returns a dict of check name -> sorted list of offending wells, the same every time no matter which shard finishes first.
+def run_validations (part_plus_water_transfers_df, output_df, library_df, n_shards=4, use_processes=False):
+    transfers = part_plus_water_transfers_df
+    library = library_df
+
+    #the 4uL check on parts alone shouldn't count the water
+    waterwell = library.loc[library['part'] == 'WATER', 'well'].values[0]
+    part_transfers = transfers.loc[transfers['part'] != waterwell]
+
+    #check name -> list of (function, args) for every shard of that check
+    jobs = {
+        'not in library' : [(find_lib_errors, (shard, library)) for shard in shard_by_well(transfers, 'part', n_shards)],
+        'parts over 4uL' : [(find_vol_errors, (shard,)) for shard in shard_by_well(part_transfers, 'target', n_shards)],
+        'not enough volume' : [(find_enough_vol_errors, (shard, library)) for shard in shard_by_well(transfers, 'part', n_shards)],
+        'final volume not 4uL' : [(find_final_vol_errors, (shard,)) for shard in shard_by_well(output_df, 'Destination Well', n_shards)],
+    }
+
+    pool_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    with pool_type(max_workers=n_shards) as pool:
+        futures = {name : [pool.submit(func, *args) for func, args in shards] for name, shards in jobs.items()}
+
+        #results are gathered in the order the shards were submitted, not the order they finish
+        violations = {name : sorted(err for future in shard_futures for err in future.result()) for name, shard_futures in futures.items()}
+
+    return violations
+
+#Run every check with run_validations and raise one error that reports all of the problems found
+def check_all (part_plus_water_transfers_df, output_df, library_df, n_shards=4, use_processes=False):
+
+    violations = run_validations(part_plus_water_transfers_df, output_df, library_df, n_shards, use_processes)
+
+    errs = []
+
+    if violations['not in library']:
+        errs.append(CHECK_MESSAGES['not in library'].format(violations['not in library']))
+    if violations['parts over 4uL']:
+        errs.append(CHECK_MESSAGES['parts over 4uL'].format(violations['parts over 4uL']))
+    if violations['not enough volume']:
+        try:
+            raise_enough_vol_errors(violations['not enough volume'], library_df)
+        except ValueError as err:
+            errs.append(str(err).strip('*'))
+    #the water is based on the part volumes, so overfilled wells would show up twice
+    final_errs = [well for well in violations['final volume not 4uL'] if well not in violations['parts over 4uL']]
+    if final_errs:
+        errs.append(CHECK_MESSAGES['final volume not 4uL'].format(final_errs))
+
+    if errs:
+        raise ValueError('***{}***'.format('. '.join(errs)))
     else:
         return None
 """end functions for checking things during echo output creation"""
 
 
+"""Begin functions for checking the whole library before planning any assemblies"""
+#Work out, for every part in the library at once, what the Echo can really do with it at the ~4nM in 4uL target:
+#the exact volume needed, the volume after rounding to 25nL drops (one drop at least, like part_transfer_list does),
+#how far off that makes the part's concentration, and how many parts at that volume fit in one 4uL well.
+#Parts whose concentration would be off by more than max_error need diluting first ('dilute by' says how many times
+#so that rounding can't be off by more than max_error), and parts too dilute to fit min_parts in a well are flagged too.
+def library_qc (library_df, max_error=0.1, min_parts=4):
+    library = library_df
+
+    #Global variables
+    targConc = 4 #nM
+    targVol = 4 #uL
+
+    #the water isn't a part
+    parts = library.loc[library['part'] != 'WATER', ['part', 'well', 'conc (nM)']].copy()
+
+    conc = pd.to_numeric(parts['conc (nM)'], errors='coerce').values.astype(float)
+    conc[conc <= 0] = np.nan
+
+    exact = (targConc / conc) * targVol * 1000 #in nL
+    rounded = np.maximum(np.round(exact / 25) * 25, 25) #echo can only transfer in increments of 25nL, at least one drop
+
+    parts['exact vol (nL)'] = exact
+    parts['echo vol (nL)'] = rounded
+    parts['conc error'] = (rounded - exact) / exact #same as how far off 4nM the part ends up
+    parts['max parts per well'] = np.floor(4000 / rounded)
+
+    #rounding to the nearest drop is off by at most 12.5nL, so the exact volume needs to be at least
+    #12.5 / max_error nL for the error to stay under max_error no matter what
+    parts['dilute by'] = np.where(np.abs(parts['conc error']) > max_error, np.ceil((12.5 / max_error) / exact), 1)
+
+    parts['needs dilution'] = np.abs(parts['conc error']) > max_error
+    parts['too dilute'] = parts['max parts per well'] < min_parts
+    parts['no conc'] = np.isnan(conc)
+
+    return parts
+
+#Just the library wells that need attention before they can be used in an assembly
+def find_qc_problems (qc_df):
+
+    return qc_df.loc[qc_df['needs dilution'] | qc_df['too dilute'] | qc_df['no conc']]
+
+#Print a short report of the library wells that need diluting, are too dilute, or have no concentration.
+#Doesn't stop anything, not every part in the library gets used in every assembly.
+def report_library_qc (library_df, max_error=0.1, min_parts=4):
+
+    problems = find_qc_problems(library_qc(library_df, max_error, min_parts))
+
+    if len(problems) == 0:
+        print('Every part in the library can be shot within {:.0%} of 4nM'.format(max_error))
+        return problems
+
+    for idx, row in problems.iterrows():
+        if row['no conc']:
+            print('  {} ({}) has no usable concentration'.format(row['well'], row['part']))
+        elif row['needs dilution']:
+            print('  {} ({}) is too concentrated, it would be {:+.0%} off 4nM. Dilute it {:.0f}x'\
+                  .format(row['well'], row['part'], row['conc error'], row['dilute by']))
+        else:
+            print('  {} ({}) is too dilute, it takes {:.0f}nL so only {:.0f} parts fit in a well'\
+                  .format(row['well'], row['part'], row['echo vol (nL)'], row['max parts per well']))
+
+    return problems
+"""end functions for checking the whole library before planning any assemblies"""
+
+
+
+"""Begin functions for incremental regeneration of pick lists"""
+#File in the current working directory that remembers the transfers made for each target well last run
+TRANSFER_CACHE = 'transfer_cache.csv'
+
+#Fingerprint each assembly row so a target well is only recalculated when it actually changed.
+#The hash covers the row's parts plus the library concentrations of those parts and the water well,
+#since all of those feed into the transfer volumes for that target.
+def hash_assembly_rows (assembly_df, library_df):
+    assemblies = assembly_df
+    library = library_df
+
+    #well -> concentration lookup so each part is a dict hit instead of a search of the library
+    conc_lookup = dict(zip(library['well'], library['conc (nM)']))
+
+    waterwell = library.loc[library['part'] == 'WATER', 'well'].values[0]
+
+    #same part columns make_part_target_pairs uses ('comment' doesn't change any transfers)
+    parts = [col for col in list(assemblies.columns) if col not in ['comment', 'targwell']]
+
+    row_hashes = {}
+
+    for idx, row in assemblies.iterrows():
+        #make_part_target_pairs only uses the first row for a given target well, so do the same here
+        if row['targwell'] in row_hashes:
+            continue
+
+        key = ['WATER={}'.format(waterwell)]
+        for part in parts:
+            key += ['{}={}@{}'.format(part, row[part], conc_lookup.get(row[part]))]
+
+        row_hashes[row['targwell']] = hashlib.md5('|'.join(key).encode('utf-8')).hexdigest()
+
+    return row_hashes
+
+#Read the transfers saved by the last run, or an empty table if there wasn't one
+def load_transfer_cache (cache_file=TRANSFER_CACHE):
+
+    if os.path.isfile(cache_file):
+        return pd.read_csv(cache_file)
+    else:
+        return pd.DataFrame(columns = ['part', 'target', 'volume', 'row hash'])
+
+#Save every transfer of this run along with the hash of the assembly row it came from
+def save_transfer_cache (transfers_df, cache_file=TRANSFER_CACHE):
+
+    transfers_df[['part', 'target', 'volume', 'row hash']].to_csv(cache_file, index=False)
+
+    return None
+
+#Recalculate the part + water transfers only for target wells whose assembly row changed since the
+#cached run, and reuse the cached transfers for all the others. Returns the full set of transfers
+#(with a 'row hash' column for the next cache) and the list of target wells that were recalculated.
+def incremental_transfers (assembly_df, library_df, cache_df):
+    assemblies = assembly_df
+    library = library_df
+    cache = cache_df
+
+    row_hashes = hash_assembly_rows(assemblies, library)
+
+    #each target well's transfers all share the row hash they were made from
+    cached_hashes = dict(zip(cache['target'], cache['row hash']))
+
+    changed = [targwell for targwell in row_hashes if cached_hashes.get(targwell) != row_hashes[targwell]]
+    unchanged = [targwell for targwell in row_hashes if targwell not in changed]
+
+    #target wells that were dropped from the assembly aren't in row_hashes, so they get left behind here
+    reused = cache.loc[cache['target'].isin(unchanged)]
+
+    if changed:
+        changed_assy = assemblies.loc[assemblies['targwell'].isin(changed)]
+
+        #same steps as a full run, just on the rows that changed (checks are done on the result with check_all)
+        part_trans = part_transfer_list(changed_assy, library)
+        recalculated = add_water_transfers(part_trans, library)
+    else:
+        recalculated = pd.DataFrame(columns = ['part', 'target', 'volume'])
+
+    recalculated['row hash'] = [row_hashes[targwell] for targwell in recalculated['target']]
+
+    transfers = pd.concat([reused, recalculated], ignore_index=True)
+
+    return transfers, changed
+"""end functions for incremental regeneration of pick lists"""
+
+
+
+"""Begin functions for making a pick list without asking anything"""
+#Read an assembly file the same way pick_assembly() does once it has been picked
+def read_assembly (assembly_file):
+
+    return pd.read_csv(assembly_file).dropna(axis=0, how='all')
+
+#Everything main() does between opening the files and saving the output, with no questions asked,
+#so other scripts (like echoWatch.py) can make pick lists too. Returns the Echo output df.
+def make_pick_list (assembly_df, library_df, use_processes=False):
+
+    assy = qualify_assembly(assembly_df, build_library_index(library_df))
+
+    part_trans = part_transfer_list(assy, library_df)
+    part_water_trans = add_water_transfers(part_trans, library_df)
+
+    output = make_echo_csv(part_water_trans)
+
+    check_all(part_water_trans, output, library_df, use_processes=use_processes)
+
+    return output
+"""end functions for making a pick list without asking anything"""
+
+
 
 """Main running block"""
 
-def main():
+def main(incremental=False, delta=False, use_processes=False, out_format='csv'):
+    """incremental=True reuses the transfers cached from the last run for every target
+    well whose assembly row didn't change. delta=True (only with incremental) writes
+    just the recalculated target wells to the pick list instead of the whole plate.
+    use_processes=True runs the checks on a pool of processes instead of threads.
+    out_format is 'csv', 'csv.gz' or 'parquet' (the Echo software itself needs csv)."""
+
     #first you need to get your library and desired assembly
     assy = pick_assembly()
     lib = pick_parts_library()
 
-    #then you should check to see if the assembly parts are in the library
-    check_if_in_lib(assy, lib)
+    #flag library wells that need diluting (or are too dilute) before planning anything with them
+    print('Checking the library concentrations...')
+    report_library_qc(lib)
 
-    #then begin by making the part-well / target-well pair assignments
-    #and calculate the volume to shoot
-    #(e.g. 550uL of part in well A1 will get shot into target well A4)
-    part_trans = part_transfer_list(assy, lib)
+    #point every part in the assembly (by well or by part name) at its library well
+    #(and plate, if several libraries were picked)
+    assy = qualify_assembly(assy, build_library_index(lib))
 
-    #now that you have calculated the volumes of each part to transfer,
-    #check to see if the total transferred volume of PARTS alone is more than 4uL
-    check_vol_errors(part_trans)
+    if incremental:
+        #only recalculate the target wells that changed since the last run
+        all_trans, changed = incremental_transfers(assy, lib, load_transfer_cache())
+        print('Recalculated {} of {} target wells'.format(len(changed), len(np.unique(all_trans['target']))))
 
-    #since all part transfers sum to 4000nL or less, you should fill the target
-    #wells with water up to 4000nL
-    part_water_trans = add_water_transfers(part_trans, lib)
+        if delta:
+            part_water_trans = all_trans.loc[all_trans['target'].isin(changed)]
+        else:
+            part_water_trans = all_trans
+    else:
+        #begin by making the part-well / target-well pair assignments
+        #and calculate the volume to shoot
+        #(e.g. 550uL of part in well A1 will get shot into target well A4)
+        part_trans = part_transfer_list(assy, lib)
 
-    #now that you have a full set of transfers with parts and water,
-    #check the library to see if there's enough volume of each thing
-    #to do the requested transfers
-    check_enough_vol (part_water_trans, lib)
+        #fill the target wells with water up to 4000nL
+        part_water_trans = add_water_transfers(part_trans, lib)
 
     #now create the df that is formatted correctly for the Echo Plate Reformat
     #software to read it
     output = make_echo_csv(part_water_trans)
 
-    #final neurotic check, make sure the output df will not transfer more than
-    #4000nL into any given target well
-    check_if_final_vols_ok(output)
+    #now that you have a full set of transfers with parts and water, run all the checks at once:
+    #parts are in the library, PARTS alone aren't more than 4uL, the library has enough volume of
+    #each thing, and (final neurotic check) every target well gets exactly 4000nL
+    check_all(part_water_trans, output, lib, use_processes=use_processes)
+
+    if incremental:
+        #remember the full set of transfers (not just the delta) for next time
+        save_transfer_cache(all_trans)
+
+    out_name = ('output_delta.' if (incremental and delta) else 'output.') + out_format
 
-    output.to_csv(os.getcwd() + '\\output.csv', index=False)
+    write_pick_list(output, out_name)
 
-    print('I did the whole thing, your Echo pick list file is called "output.csv"')
+    print('I did the whole thing, your Echo pick list file is called "{}"'.format(out_name))
 
     return None
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Make an Echo pick list for a MoClo assembly, everything else gets asked as it goes')
+    parser.add_argument('--incremental', action='store_true', help='reuse the cached transfers for target wells whose assembly row did not change')
+    parser.add_argument('--delta', action='store_true', help='with --incremental, only write the recalculated target wells to the pick list')
+    parser.add_argument('--processes', action='store_true', help='run the checks on a pool of processes instead of threads')
+    parser.add_argument('--format', default='csv', choices=sorted(PICK_LIST_BACKENDS), help='how to save the pick list (the Echo needs csv)')
+    args = parser.parse_args()
+
+    if args.delta and not args.incremental:
+        parser.error('--delta only works with --incremental')
+
+    main(args.incremental, args.delta, args.processes, args.format)
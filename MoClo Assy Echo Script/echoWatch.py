@@ -0,0 +1,271 @@
+"""
+### Echo Watch Folder Script ###
+
+This script keeps an eye on a folder so nobody has to run MoCloAssy.py or
+updatePartLib.py by hand. It never asks anything, so it can be left running.
+
+*Drop an assembly .csv into the watched folder and its Echo pick list shows up
+    in the "pick lists" folder inside it, called "<assembly name> pick list.csv"
+*Once a pick list has actually been run on the Echo, move it into the
+    "completed" folder inside the watched folder and the library files get
+    updated. If the Echo's transfer or exception report is saved next to it as
+    "<pick list name> report.csv", only what the Echo really shot is subtracted.
+
+Run it with the folder to watch and the library file(s) to use:
+    python echoWatch.py "path/to/folder" "lib plate 1.xlsx" "lib plate 2.xlsx"
+Stop it with Ctrl+C.
+
+Files are only picked up once they have stopped changing for a couple of
+seconds (so half copied files are left alone), then go into a queue that a few
+workers take jobs from. The queue has a size limit, and the folder isn't
+looked at again while it's full, so a big pile of files can't swamp it. A pick
+list is never taken out of a library twice (updatePartLib.py keeps track), so to
+take the same pick list out again after running it again, save the Echo report
+of the new run next to it or use updatePartLib.py.
+Files that are already in the folders when it starts get picked up too. A job
+that fails (say a library file was open in Excel) is tried again a minute later,
+or as soon as the file is changed.
+
+Created: 10/19/2026
+"""
+
+import os
+import sys
+import asyncio
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import MoCloAssy
+
+
+#updatePartLib.py sits in the same folder on Windows, but the folder name's capitals differ in the repository
+#('moclo assy echo script'), which matters on Linux, so look in both places
+def load_update_part_lib ():
+
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    for folder in [here, os.path.join(os.path.dirname(here), 'moclo assy echo script')]:
+        script = os.path.join(folder, 'updatePartLib.py')
+        if os.path.isfile(script):
+            spec = importlib.util.spec_from_file_location('updatePartLib', script)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+
+    raise ImportError('Could not find updatePartLib.py next to this script')
+
+updatePartLib = load_update_part_lib()
+
+
+"""Begin functions for the jobs the workers do"""
+#Read the libraries fresh for each assembly so the latest volumes get checked
+def read_libraries (library_files):
+
+    libs = [(path, os.path.splitext(os.path.basename(path))[0]) for path in library_files]
+
+    return MoCloAssy.merge_libraries(MoCloAssy.load_libraries(libs))
+
+#Make the pick list for one assembly file from the libraries read by read_libraries()
+def assembly_job (assembly_file, library_df, out_dir):
+
+    output = MoCloAssy.make_pick_list(MoCloAssy.read_assembly(assembly_file), library_df)
+
+    out_name = os.path.splitext(os.path.basename(assembly_file))[0] + ' pick list.csv'
+
+    return MoCloAssy.write_pick_list(output, os.path.join(out_dir, out_name))
+
+#Take one completed pick list out of every library it used. Every library is checked before any gets written, and
+#the ones that already have this run in their history are skipped, so if writing one library fails (e.g. it's
+#open in Excel) trying the job again just finishes off the rest. Returns the library files that were updated.
+def completed_job (pick_list_file, library_files):
+
+    stem = os.path.splitext(pick_list_file)[0]
+
+    report_file = stem + ' report.csv'
+    if not os.path.isfile(report_file):
+        report_file = None
+
+    #a pick list made from a single library just says 'Source[1]' (a blank plate is read as that too), which
+    #can't tell the libraries apart, so taking it out of more than one library would subtract the same transfers
+    #from different plates
+    plates = set(updatePartLib.read_pick_list_chunked(pick_list_file)['Source Plate Name'])
+    lib_names = [os.path.splitext(os.path.basename(path))[0] for path in library_files]
+
+    if 'Source[1]' in plates and len(library_files) > 1:
+        raise ValueError('***{} names Source[1] (or no plate) for some transfers, so I cannot tell which of the libraries {} they came from. '\
+                         'Update the right library with updatePartLib.py instead***'.format(pick_list_file, lib_names))
+
+    unknown = sorted(plates - set(lib_names) - set(['Source[1]']))
+    if unknown:
+        raise ValueError('***{} uses the source plates {}, which are not any of the libraries {}***'.format(pick_list_file, unknown, lib_names))
+
+    todo = []
+    for library_file in library_files:
+        done = updatePartLib.already_used(library_file, pick_list_file, report_file)
+        if done is None:
+            todo.append(library_file)
+        else:
+            print('{} was already taken out of {} on {}, skipping that library'.format(pick_list_file, library_file, done))
+
+    if not todo:
+        return todo
+
+    used_vols = updatePartLib.used_volumes(pick_list_file, report_file, stem + ' discrepancies.csv')
+
+    for library_file in todo:
+        history_file, run_hash = updatePartLib.check_not_already_used(library_file, pick_list_file, report_file)
+        lib_name = os.path.splitext(os.path.basename(library_file))[0]
+        updatePartLib.apply_update(library_file, lib_name, used_vols, history_file, run_hash)
+
+    return todo
+"""end functions for the jobs the workers do"""
+
+
+"""Begin functions for watching the folder"""
+#column labels a pick list can have, same as updatePartLib.find_pick_lists() looks for
+full_pl_cols = ['Source Plate Name', 'Source Plate Type', 'Source Well',
+'Sample ID', 'Sample Name', 'Sample Group', 'Sample Comment',
+'Destination Plate Name', 'Destination Well', 'Transfer Volume']
+
+#What kind of job a new csv file is: 'assembly', 'completed' (a run pick list) or None to ignore it.
+#Only the header is read. Echo reports and discrepancy lists have other columns too, so they're skipped
+#(reports get found by the pick list they belong to).
+def job_kind (csv_file, in_completed):
+
+    try:
+        cols = pd.read_csv(csv_file, nrows=0).columns
+    except (IOError, ValueError):
+        return None
+
+    if in_completed:
+        if 'Source Well' in cols and all(x in full_pl_cols for x in cols):
+            return 'completed'
+    elif 'promoter' in cols and 'targwell' in cols:
+        return 'assembly'
+
+    return None
+
+#(modification time, size) of every csv file in a folder, using one scandir pass
+def csv_signatures (folder):
+
+    sigs = {}
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name[-3:] == 'csv':
+                stat = entry.stat()
+                sigs[entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+    return sigs
+
+#Look at the folder every poll seconds. A file becomes a job once its signature has stayed the same for debounce
+#seconds, and again if it gets changed later or if its job failed more than retry seconds ago. queue.put() waits
+#while the queue is full, which pauses the looking until the workers catch up.
+#queued (path -> signature it was queued with) and failed (path -> when its job failed) are shared with the workers.
+async def scan_folder (folder, completed_dir, queue, poll, debounce, queued, failed, retry):
+
+    loop = asyncio.get_running_loop()
+
+    #path -> (signature, when it was first seen with that signature)
+    seen = {}
+
+    while True:
+        now = loop.time()
+
+        for in_completed, directory in [(False, folder), (True, completed_dir)]:
+            for path, sig in csv_signatures(directory).items():
+                if path not in seen or seen[path][0] != sig:
+                    seen[path] = (sig, now)
+                    continue
+
+                if now - seen[path][1] < debounce:
+                    continue
+
+                if queued.get(path) == sig:
+                    if path not in failed or now - failed[path] < retry:
+                        continue
+                    del failed[path]
+
+                queued[path] = sig
+
+                kind = job_kind(path, in_completed)
+                if kind is not None:
+                    await queue.put((kind, path))
+
+        await asyncio.sleep(poll)
+
+#Take jobs off the queue and run them on the thread pool. Library updates hold the lock so two of them can't write
+#the same library file at once, and reading the libraries for an assembly holds it too so it never reads a file that's
+#half written. A job that fails is reported and noted in failed so scan_folder tries it again, and the worker moves on.
+async def worker (queue, pool, library_files, out_dir, library_lock, failed):
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        kind, path = await queue.get()
+
+        try:
+            if kind == 'assembly':
+                async with library_lock:
+                    lib = await loop.run_in_executor(pool, read_libraries, library_files)
+                out = await loop.run_in_executor(pool, assembly_job, path, lib, out_dir)
+                print('Made the pick list {} from {}'.format(out, path))
+            else:
+                async with library_lock:
+                    updated = await loop.run_in_executor(pool, completed_job, path, library_files)
+                if updated:
+                    print('Took {} out of the libraries {}'.format(path, updated))
+            failed.pop(path, None)
+        except Exception as err:
+            failed[path] = loop.time()
+            print('***Could not do {}: {}***'.format(path, str(err).strip('*')))
+        finally:
+            queue.task_done()
+
+#Watch a folder (and its 'completed' folder) and keep making pick lists and updating libraries until stopped
+async def watch (folder, library_files, n_workers=2, queue_size=8, poll=1.0, debounce=2.0, retry=60.0):
+
+    folder = os.path.abspath(folder)
+    library_files = [os.path.abspath(path) for path in library_files]
+
+    out_dir = os.path.join(folder, 'pick lists')
+    completed_dir = os.path.join(folder, 'completed')
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(completed_dir, exist_ok=True)
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    library_lock = asyncio.Lock()
+    queued = {}
+    failed = {}
+
+    print('Watching {} for assemblies and {} for completed pick lists'.format(folder, completed_dir))
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        workers = [asyncio.ensure_future(worker(queue, pool, library_files, out_dir, library_lock, failed)) for i in range(n_workers)]
+
+        try:
+            await scan_folder(folder, completed_dir, queue, poll, debounce, queued, failed, retry)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    return None
+"""end functions for watching the folder"""
+
+
+
+def main():
+    if len(sys.argv) < 3:
+        raise ValueError('Give the folder to watch and at least one library file, e.g. python echoWatch.py "my folder" "my lib.xlsx"')
+
+    try:
+        asyncio.run(watch(sys.argv[1], sys.argv[2:]))
+    except KeyboardInterrupt:
+        print('Stopped watching')
+
+    return None
+
+if __name__ == '__main__':
+    main()
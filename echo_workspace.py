@@ -0,0 +1,88 @@
+r"""
+Bits shared by the Echo scripts (MoCloAssy.py, updatePartLib.py and the rest), kept here
+so there's only one copy of each to fix.
+
+The scripts in the MoClo folders find this file by adding the folder above them to the
+python path, so keep it next to for2backslash.py. If you copy a script somewhere else,
+copy this file next to it too.
+"""
+#Handles finding the files to be used in the scripts
+import os
+from pathlib import Path, PureWindowsPath
+
+
+
+"""Begin block of functions for finding files"""
+
+#directory -> (modification time, list of (file name, full path)) for each directory already listed this run
+dir_listing_cache = {}
+
+#Lists the files (not folders) in a directory with one os.scandir pass, which already knows which entries
+#are files, instead of os.listdir and then asking about every entry. Paths are built by the OS so they work
+#on Windows and Linux. The listing is reused until a file is added, removed or renamed in the directory
+#(which changes its modification time), so looking for libraries, assemblies, etc. only reads it once.
+def list_files (directory=None):
+
+    directory = os.path.abspath(directory or os.getcwd())
+    mtime = os.stat(directory).st_mtime_ns
+
+    cached = dir_listing_cache.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with os.scandir(directory) as entries:
+        files = sorted((entry.name, entry.path) for entry in entries if entry.is_file())
+
+    dir_listing_cache[directory] = (mtime, files)
+
+    return files
+
+#Swap the backslashes in a Windows path (C:\Users\me\lib.xlsx) for forward slashes, ignoring surrounding quotes and spaces
+def normalize_path (path):
+
+    return PureWindowsPath(path.strip().strip('"')).as_posix()
+
+"""end file finding functions"""
+
+
+"""Begin functions for saving the Echo output"""
+#Each way a pick list can be saved, takes the output df and a path or an open file/buffer
+def write_csv (output_df, dest):
+    output_df.to_csv(dest, index=False)
+
+def write_csv_gz (output_df, dest):
+    output_df.to_csv(dest, index=False, compression='gzip')
+
+def write_parquet (output_df, dest):
+    #the output df is filled in cell by cell so its columns are all 'object', parquet wants real types
+    output_df.infer_objects().to_parquet(dest, index=False)
+
+#format name -> writer, the format name is also the file ending
+PICK_LIST_BACKENDS = {'csv' : write_csv, 'csv.gz' : write_csv_gz, 'parquet' : write_parquet}
+
+#Work out the format from a file name's ending, e.g. 'output.csv.gz' -> 'csv.gz'
+def pick_list_format (file_name):
+
+    for fmt in sorted(PICK_LIST_BACKENDS, key=len, reverse=True):
+        if str(file_name).endswith('.' + fmt):
+            return fmt
+
+    raise ValueError('***I do not know how to save {}, use one of the endings {}***'.format(file_name, sorted(PICK_LIST_BACKENDS)))
+
+#Save the Echo output. dest can be a file name (relative ones go in the current working directory)
+#whose ending picks the format, or an in-memory buffer like io.StringIO / io.BytesIO (csv unless fmt is given).
+#Returns the full path of the saved file, or the buffer.
+def write_pick_list (output_df, dest, fmt=None):
+
+    if hasattr(dest, 'write'):
+        PICK_LIST_BACKENDS[fmt or 'csv'](output_df, dest)
+        return dest
+
+    path = Path(dest)
+    if not path.is_absolute():
+        path = Path.cwd() / path
+
+    PICK_LIST_BACKENDS[fmt or pick_list_format(path.name)](output_df, path)
+
+    return path
+"""end functions for saving the Echo output"""
@@ -1,10 +1,21 @@
-import pyperclip as pyp
+r"""
+Turns Windows file paths (C:\Users\me\Desktop\lib.xlsx) into python friendly ones
+with forward slashes (C:/Users/me/Desktop/lib.xlsx). Paths that already use forward
+slashes come out the same.
 
-print ('Please input your copied file path: ')
-text = input()
+Give it the paths to fix: python for2backslash.py "C:\some\path" "D:\another"
+or pipe them in one per line: type paths.txt | python for2backslash.py
+or import normalize_path() from echo_workspace.py
+"""
 
-fixed = text.replace('\\', '/')
+import sys
 
-pyp.copy(fixed)
+#normalize_path is shared with the Echo scripts, so it lives in echo_workspace.py
+from echo_workspace import normalize_path
 
-print ('Your python compatible file path has been copied to the clipboard')
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or [line for line in sys.stdin.read().splitlines() if line.strip()]
+
+    for path in paths:
+        print (normalize_path(path))
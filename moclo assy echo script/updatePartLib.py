@@ -21,8 +21,12 @@ Created: 10/07/2017
 
 Updated: 10/09/2017
 
-Update Notes: Doesn't yet write over the original library. Possible add function
-to just append new sheets to the library where sheet name is the time of update.
+Update Notes: The volumes in the original library file are updated in place, and
+each update is recorded as just the change in volume of each well used in a
+"<library> history.csv" file next to the library, so any past state of the library
+can be rebuilt. Running it with --vol-column also keeps the volumes after each update
+as a new timestamped column in the library file. Using the same pick list (and Echo report) on a library twice asks
+first, in case it was really run on the Echo again.
 Added a verification step "do you really want to update?"
 
 """
@@ -30,7 +34,20 @@ Added a verification step "do you really want to update?"
 import pandas as pd
 import numpy as np
 import os
-import string
+import time
+import sys
+import argparse
+
+#list_files is shared with the other Echo scripts, it lives in echo_workspace.py in the folder above this one
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from echo_workspace import list_files
+
+#Handles fingerprinting pick lists so the history knows which run made each change
+import hashlib
+
+#Handles writing the updated volumes back into the library .xlsx file
+import openpyxl
+from openpyxl.utils import get_column_letter
 
 
 """Functions for updating input library to reflect volumes used in assembly"""
@@ -40,8 +57,8 @@ import string
 # or just out of neuroticism, running this function each time will subtract from the library
 # volumes, even though an assembly has not been done. Only use this function when an assembly
 # has actually been done!***
-def update_lib_vols (pick_list_df, library_df):
-    output = pick_list_df
+def update_lib_vols (pick_list_df, library_df, plate_name=None):
+    output = rows_for_library(pick_list_df, plate_name)
     library = library_df
 
     for part in np.unique(output['Source Well']):
@@ -58,6 +75,28 @@ def update_lib_vols (pick_list_df, library_df):
 
     return library
 
+#Pick lists made from several libraries name each library in 'Source Plate Name', so only keep the
+#transfers that came out of this library. Pick lists from a single library just say 'Source[1]'
+#for everything, in which case all the transfers came from it. A blank plate counts as 'Source[1]'.
+def rows_for_library (pick_list_df, plate_name=None):
+    output = pick_list_df
+
+    if plate_name is None or 'Source Plate Name' not in output.columns:
+        return output
+
+    plates = set(output['Source Plate Name'].fillna('Source[1]'))
+
+    if plates <= set(['Source[1]']):
+        return output
+
+    #a few unnamed transfers among named ones can't be put down to any library, don't just lose them
+    if 'Source[1]' in plates:
+        wells = sorted(output.loc[output['Source Plate Name'].fillna('Source[1]') == 'Source[1]', 'Source Well'].unique())
+        raise ValueError('***The transfers out of the wells {} have no source plate name (or just Source[1]) '\
+                         'but the rest of the pick list names its plates, fix the pick list***'.format(wells))
+
+    return output.loc[output['Source Plate Name'] == plate_name]
+
 #verify the user wants to udpate their library sheet, gives option to correct a mistake
 def check_before_update():
     YorN = input('Do you really want to update this library with this assembly? (y/n)   ')
@@ -81,25 +120,27 @@ def find_part_libraries_RM ():
     #Get name of directory where the current script, along with all other library and assembly files, lives
     currdir = os.getcwd()
 
-    #go through all the items in this directory, files, folders, everything, then save only items that are files
-    onlyfiles = [item for item in os.listdir(currdir) if os.path.isfile(currdir + '\\' + item)]
+    #get all the files (not folders) in this directory, as (file name, full path) pairs
+    onlyfiles = list_files(currdir)
 
     #initialize list of possible library files
     libs = []
 
-    for file in onlyfiles:
+    for file, filepath in onlyfiles:
         #if file is an xlsx file (which library files should be)
         if(file[-4:]=='xlsx'):
 
             #read the excel file as a dictionary
             #with each sheetname generating a key for the dict to access each sheet individually
-            xl_file = pd.read_excel(currdir + '\\' + file, sheetname=None)
+            xl_file = pd.read_excel(filepath, sheet_name=None)
 
             #check each sheet in that excel file
             for key in xl_file.keys():
                 #check if the column labels 'part' and 'well' are in this sheet, if so, file is probably a library
                 if ('part' in xl_file[key].columns and 'well' in xl_file[key].columns):
-                    libs+=[('{}\\{}'.format(currdir, file), file[:-5])]
+                    libs+=[(filepath, file[:-5])]
+                    #only list each file once, however many of its sheets look like a library
+                    break
 
     return sorted(libs)[::-1]
 
@@ -109,19 +150,20 @@ def find_pick_lists ():
     #Get name of directory where the current script, along with all other library and assembly files, lives
     currdir = os.getcwd()
 
-    #go through all the items in this directory, files, folders, everything, then save only items that are files
-    onlyfiles = [item for item in os.listdir(currdir) if os.path.isfile(currdir + '\\' + item)]
+    #get all the files (not folders) in this directory, as (file name, full path) pairs
+    onlyfiles = list_files(currdir)
 
     #initialize list of possible assembly files
     pls = []
 
-    for file in onlyfiles:
+    for file, filepath in onlyfiles:
         #if file is a csv, which pick lists should be
         if(file[-3:] =='csv'):
 
             #try to do the following stuff, except pass on an IOError from pd.read_csv
             try:
-                pick_csv = pd.read_csv(currdir + '\\' + file)
+                #only the header is needed to recognize a pick list, don't read the whole (maybe huge) file
+                pick_csv = pd.read_csv(filepath, nrows=0)
 
                 #check if the column labels from a complete pick list are in this df, if so, file is probably a pick list
                 full_pl_cols = ['Source Plate Name', 'Source Plate Type', 'Source Well',
@@ -129,15 +171,16 @@ def find_pick_lists ():
                 'Destination Plate Name', 'Destination Well', 'Transfer Volume']
 
                 if (all(x in full_pl_cols for x in pick_csv.columns)):
-                    pls += [('{}\\{}'.format(currdir, file), file[:-4])]
+                    pls += [(filepath, file[:-4])]
             except IOError:
                 pass
     return sorted(pls)[::-1]
 
 # user interface for picking a library of parts to use. This list must
 # contain the concentration of each part as well as the 384 well location
-# of each part.
-def pick_parts_library ():
+# of each part. Returns the (path, short filename) tuple of the library picked,
+# the short filename is the plate name used in pick lists made from several libraries.
+def choose_parts_library ():
 
     look = input('Is this: {}\nwhere you want to look for parts libraries? (y/n)   '.format(os.getcwd()))
     if look in ['y', 'Y']:
@@ -165,19 +208,24 @@ def pick_parts_library ():
 
         if(len(partLibList) == 1):
             #choose the first and only entry in the libraries list
-            #set pickedlist to be the PATH (not the shortened filename) of that library
-            pickedlist = partLibList[0][0]
+            pickedlist = partLibList[0]
             print ('picked the only one in the list!')
         else:
             userpick = input('type the number of the one you used to make your assembly.   ')
-            pickedlist = partLibList[int(userpick)][0]
-    openlist = pd.read_excel(pickedlist)
+            pickedlist = partLibList[int(userpick)]
+
+    return pickedlist
+
+# user interface for picking a library of parts to use, returns the opened library
+def pick_parts_library ():
+
+    openlist = pd.read_excel(choose_parts_library()[0])
 
     print ("===================================")
     return openlist
 
-#user interface for picking the assembly to build
-def pick_pick_list ():
+#user interface for picking the pick list that was run, returns the path of the pick list
+def choose_pick_list ():
 
     look = input('Is this: {}\nwhere you want to look for pick list files? (y/n)   '.format(os.getcwd()))
     if look in ['y', 'Y']:
@@ -209,48 +257,397 @@ def pick_pick_list ():
             userpick = input('type the number of the one you ran on the Echo.   ')
             pickedlist = plList[int(userpick)][0]
 
-    openpl = pd.read_csv(pickedlist)
+    return pickedlist
+
+#user interface for picking the pick list that was run, returns the total volume taken from each source well
+def pick_pick_list ():
+
+    openpl = read_pick_list_chunked(choose_pick_list())
 
-    openpl = openpl.dropna(axis=0, how='all')
     print ("===================================")
     return openpl
+
+#user interface for picking the Echo's exported transfer (or exception) report for the run, if there is one.
+#Returns the path of the report, or None to just use the planned pick list.
+def choose_transfer_report ():
+
+    have = input('Do you have the Echo transfer or exception report for this run? (y/n)   ')
+    if have not in ['y', 'Y']:
+        return None
+
+    print ('Searching for Echo transfer reports...')
+
+    reportList = find_transfer_reports()
+
+    if(len(reportList) <= 0):
+        raise ValueError('Could not find any Echo transfer reports')
+
+    for el in range(len(reportList)):
+        print ('[{}]  {}'.format(el,reportList[el][1]))
+
+    if(len(reportList)==1):
+        pickedreport = reportList[0][0]
+        print ("picked the only one in the list!")
+    else:
+        userpick = input('type the number of the report from the run.   ')
+        pickedreport = reportList[int(userpick)][0]
+
+    print ("===================================")
+    return pickedreport
+
+#gets a list of the Echo transfer and exception reports present in THE CURRENT PATH
+def find_transfer_reports ():
+
+    currdir = os.getcwd()
+
+    onlyfiles = list_files(currdir)
+
+    reports = []
+
+    for file, filepath in onlyfiles:
+        if(file[-3:] =='csv'):
+            try:
+                #Echo reports have the 'Actual Volume' the Echo really shot, pick lists don't
+                table = find_table(filepath)
+                if table is not None and 'Actual Volume' in table[1]:
+                    reports += [(filepath, file[:-4])]
+            except IOError:
+                pass
+    return sorted(reports)[::-1]
+
+#Echo reports are split into sections, each starting with a marker line like [EXCEPTIONS] or [DETAILS], with
+#lines of run details mixed in. Find the table of transfers to read: a table starts at a line with a 'Source Well'
+#column label and ends at a blank line, the next marker or the end of the file. The [DETAILS] table (every transfer
+#the Echo did) is used when there is one, otherwise the first table. A plain pick list is one table starting on the
+#first line, which is returned right away without reading the rest of the (maybe huge) file.
+#Returns (number of lines to skip, list of column labels, whether the table is in an exceptions section, number of
+#rows in the table or None for "to the end of the file"), or None if there is no table.
+def find_table (csv_file):
+
+    tables = []
+    section = None
+    current = None
+
+    with open(csv_file) as f:
+        for num, line in enumerate(f):
+            cols = [col.strip() for col in line.rstrip('\n').split(',')]
+
+            if num == 0 and 'Source Well' in cols:
+                return 0, cols, False, None
+
+            #marker line, a new section starts
+            if cols[0].startswith('[') and cols[0].endswith(']'):
+                section = cols[0].upper()
+                current = None
+                continue
+
+            #blank line (or a row of empty cells), the table ends
+            if not any(cols):
+                current = None
+                continue
+
+            if current is None:
+                if 'Source Well' in cols:
+                    current = {'section' : section, 'skip' : num, 'cols' : cols, 'rows' : 0}
+                    tables.append(current)
+            else:
+                current['rows'] += 1
+
+    if not tables:
+        return None
+
+    details = [table for table in tables if table['section'] == '[DETAILS]']
+    table = details[0] if details else tables[0]
+
+    is_exceptions = table['section'] is not None and 'EXCEPTION' in table['section']
+
+    return table['skip'], table['cols'], is_exceptions, table['rows']
+
+#Columns that say where a transfer came from
+SOURCE_KEYS = ['Source Plate Name', 'Source Well']
+
+#Columns that say where a transfer came from and went to, for matching a report up with its pick list
+TRANSFER_KEYS = ['Source Plate Name', 'Source Well', 'Destination Well']
+
+#Read a pick list (or Echo report) a chunk of rows at a time, only keeping the key columns and the volume column,
+#and add up the volume for each combination of keys as the chunks come in. Names are read as categories and volumes
+#as 32 bit floats. Memory only depends on the chunk size and the number of different keys (at most 384 source wells
+#per plate for SOURCE_KEYS), not on how long the file is. Returns a df with the keys and the total volume (nL).
+def read_pick_list_chunked (pick_list_file, chunksize=100000, keys=SOURCE_KEYS, vol_col='Transfer Volume'):
+
+    #only read the transfers table (Echo reports have other lines and sections around it)
+    table = find_table(pick_list_file)
+    skiprows, nrows = (table[0], table[3]) if table is not None else (0, None)
+
+    usecols = keys + [vol_col]
+    dtypes = dict([(key, 'category') for key in keys] + [(vol_col, 'float32')])
+
+    totals = {}
+
+    reader = pd.read_csv(pick_list_file, skiprows=skiprows, nrows=nrows, usecols=lambda col: col in usecols, dtype=dtypes, chunksize=chunksize)
+
+    for chunk in reader:
+        #same as dropping the empty rows of the whole file, but only for the chunk in memory
+        chunk = chunk.dropna(subset=[key for key in keys if key != 'Source Plate Name'] + [vol_col])
+
+        #hand made pick lists don't always have a plate column, those all come from the one source plate
+        if 'Source Plate Name' in keys and 'Source Plate Name' not in chunk.columns:
+            chunk['Source Plate Name'] = 'Source[1]'
+
+        #same for a blank plate cell, groupby would throw the row away otherwise
+        if 'Source Plate Name' in keys and chunk['Source Plate Name'].isnull().any():
+            plate = chunk['Source Plate Name']
+            if 'Source[1]' not in plate.cat.categories:
+                plate = plate.cat.add_categories(['Source[1]'])
+            chunk['Source Plate Name'] = plate.fillna('Source[1]')
+
+        summed = chunk.groupby(keys, observed=True, sort=False)[vol_col].sum()
+
+        for key, vol in summed.items():
+            totals[key] = totals.get(key, 0) + float(vol)
+
+    return pd.DataFrame([list(key) + [vol] for key, vol in sorted(totals.items())], columns = keys + [vol_col])
 """end library and assembly file choosing and opening"""
 
 
+"""Begin functions for reconciling against what the Echo actually did"""
+#Line up the planned transfers with the Echo's report of the run and work out how much really left each source well.
+#With a transfer report (every transfer the Echo did), anything planned but missing from the report was skipped.
+#With an exception report (only the transfers that went wrong), anything not in the report went as planned.
+#Returns one row per (source plate, source well, destination well) with the 'Transfer Volume' planned, the
+#'Delivered Volume' and the 'Discrepancy' (delivered - planned), all in nL.
+def reconcile_transfers (pick_list_file, report_file, exceptions_only=None):
+
+    planned = read_pick_list_chunked(pick_list_file, keys=TRANSFER_KEYS)
+
+    table = find_table(report_file)
+    if table is None:
+        raise ValueError('***Could not find the transfer table in the Echo report {}***'.format(report_file))
+
+    #let the report say what kind it is (which section its table is in) unless told otherwise
+    if exceptions_only is None:
+        exceptions_only = table[2]
+
+    report_vol = 'Actual Volume' if 'Actual Volume' in table[1] else 'Transfer Volume'
+    report = read_pick_list_chunked(report_file, keys=TRANSFER_KEYS, vol_col=report_vol)
+    report = report.rename(columns={report_vol : 'Reported Volume'})
+
+    #outer join so transfers the Echo did that weren't planned show up too
+    merged = planned.merge(report, on=TRANSFER_KEYS, how='outer', indicator=True)
+    merged['Transfer Volume'] = merged['Transfer Volume'].fillna(0)
+
+    in_report = merged['_merge'] != 'left_only'
+
+    if exceptions_only:
+        delivered = np.where(in_report, merged['Reported Volume'].fillna(0), merged['Transfer Volume'])
+    else:
+        delivered = np.where(in_report, merged['Reported Volume'].fillna(0), 0)
+
+    merged['Delivered Volume'] = delivered
+    merged['Discrepancy'] = merged['Delivered Volume'] - merged['Transfer Volume']
+
+    return merged[TRANSFER_KEYS + ['Transfer Volume', 'Delivered Volume', 'Discrepancy']]
+
+#Just the transfers that didn't go as planned
+def find_discrepancies (reconciled_df):
+
+    return reconciled_df.loc[reconciled_df['Discrepancy'] != 0]
+
+#Total volume actually delivered out of each source well, in the same format as read_pick_list_chunked()
+#so it can go straight into update_lib_vols()
+def delivered_by_source (reconciled_df):
+
+    delivered = reconciled_df.groupby(SOURCE_KEYS, sort=True)['Delivered Volume'].sum().reset_index()
+
+    return delivered.rename(columns={'Delivered Volume' : 'Transfer Volume'})
+"""end functions for reconciling against what the Echo actually did"""
+
+
+"""Begin functions for keeping a history of library volumes"""
+#Each update is stored as one row per well whose volume changed: when it happened, the hash of the pick list
+#that did it (see hash_run), the well and the change in uL. That's a few rows per run instead of a whole copy of the library.
+HISTORY_COLS = ['timestamp', 'pick list hash', 'well', 'change (uL)']
+
+#The history for a library lives next to it, "my lib.xlsx" -> "my lib history.csv"
+def history_file_for (library_file):
+
+    return os.path.splitext(library_file)[0] + ' history.csv'
+
+#md5 of a file's contents, read a piece at a time so big pick lists don't have to fit in memory
+def hash_file (file_name, blocksize=1 << 20):
+
+    md5 = hashlib.md5()
+
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+#What a run is known by in the history: the md5 of its pick list, or with the Echo's report of the run the md5 of
+#both together, so running the same pick list again and updating with the new report doesn't look like a repeat
+def hash_run (pick_list_file, report_file=None):
+
+    if report_file is None:
+        return hash_file(pick_list_file)
+
+    return hashlib.md5((hash_file(pick_list_file) + hash_file(report_file)).encode()).hexdigest()
+
+#Read the history of a library, or an empty one if it hasn't been updated with a history yet
+def load_history (history_file):
+
+    if os.path.isfile(history_file):
+        return pd.read_csv(history_file, dtype={'pick list hash' : str, 'well' : str})
+    else:
+        return pd.DataFrame(columns = HISTORY_COLS)
+
+#Returns the timestamp of the last update done with this pick list, or None if it was never used on this library
+def when_recorded (history_df, pick_list_hash):
+
+    done = history_df.loc[history_df['pick list hash'] == pick_list_hash, 'timestamp']
+
+    return done.values[-1] if len(done) else None
+
+#Work out how much each well's volume changed between the old and the updated library and add those
+#changes to the end of the history file. Wells that didn't change aren't stored.
+def record_update (old_library_df, updated_library_df, history_file, pick_list_hash, timestamp=None):
+
+    if timestamp is None:
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    old_vols = old_library_df.set_index('well')['Vol (uL) in plate']
+    new_vols = updated_library_df.set_index('well')['Vol (uL) in plate']
+
+    #round to a tenth of a nL so the history doesn't keep float noise like -0.3999999999999986
+    change = (new_vols - old_vols.reindex(new_vols.index)).fillna(0).round(4)
+    change = change[change != 0]
+
+    delta = pd.DataFrame({'timestamp' : timestamp, 'pick list hash' : pick_list_hash,
+                          'well' : change.index, 'change (uL)' : change.values}, columns = HISTORY_COLS)
+
+    #only write the column labels the first time
+    delta.to_csv(history_file, mode='a', header=not os.path.isfile(history_file), index=False)
+
+    return delta
+
+#Rebuild the library as it was at a given time ('YYYY-MM-DD HH:MM:SS') by undoing every change recorded after it
+def library_at (current_library_df, history_df, timestamp):
+
+    library = current_library_df.copy()
+
+    later = history_df.loc[history_df['timestamp'] > timestamp]
+    undo = later.groupby('well')['change (uL)'].sum()
+
+    library['Vol (uL) in plate'] = library['Vol (uL) in plate'] - library['well'].map(undo).fillna(0)
+
+    return library
+
+#Table of how much of each well was used in each update (rows are wells, columns are update times, in uL),
+#plus the total used and the average uL per day between the first and last update
+def usage_history (history_df):
+
+    used = history_df.assign(**{'used (uL)' : -history_df['change (uL)']})
+
+    usage = used.pivot_table(index='well', columns='timestamp', values='used (uL)', aggfunc='sum', fill_value=0)
+
+    times = pd.to_datetime(used['timestamp'])
+    days = max((times.max() - times.min()).total_seconds() / 86400.0, 1) if len(times) else 1
+
+    usage['total used (uL)'] = usage.sum(axis=1)
+    usage['uL per day'] = usage['total used (uL)'] / days
+
+    return usage
+
+#Save the usage table for a library as a csv for working out how fast parts are being used up
+def export_usage_history (library_file, out_file=None):
+
+    if out_file is None:
+        out_file = os.path.splitext(library_file)[0] + ' usage.csv'
+
+    usage_history(load_history(history_file_for(library_file))).to_csv(out_file)
+
+    print('I saved the usage history as: {}'.format(out_file))
+
+    return None
+"""end functions for keeping a history of library volumes"""
+
+
 """Begin block of functions for writing the updated dataframe"""
-def write_to_xlsx (updated_lib_df):
+#Update the volumes like write_vols_in_place, and also add a 'Vol (uL) at <time of the update>' column to the end
+#of the first sheet, so the library file itself shows how the volumes went down over time. openpyxl can't change
+#one sheet of an .xlsx without writing the whole file again, so the workbook is streamed a row at a time from a
+#read only copy into a write only one: memory stays the same however big the library is, and any number of columns
+#works. The cell values (and formulas) of every sheet are copied as they are, but the formatting (colors, column
+#widths, ...) is not. The new file is written next to the library and then swapped in, so the library is never
+#left half written.
+def append_vol_column (updated_lib_df, library_file):
 
-    """I don't really understand what a writer object is for this xlsxwriter stuff
-    I think the writer object is like a set of formatting instructions for dataframes,
-    which we use to convert the df to an xlsx document. Why I can modify the writer
-    object after I have alread converted the df to xlsx is a mystery to me.
-    It works though """
+    col_name = time.strftime('Vol (uL) at %Y-%m-%d %H:%M:%S')
+    new_vols = dict(zip(updated_lib_df['well'], updated_lib_df['Vol (uL) in plate']))
 
+    source = openpyxl.load_workbook(library_file, read_only=True)
+    target = openpyxl.Workbook(write_only=True)
 
-    #create ExcelWriter object to handle creating your new library file as .xlsx
-    new_file_name = 'new updated lib.xlsx'
-    writer = pd.ExcelWriter(new_file_name, engine='xlsxwriter')
+    for num, sheet in enumerate(source.worksheets):
+        #the size saved in the file isn't always right, work it out from the rows themselves
+        sheet.reset_dimensions()
+        copy = target.create_sheet(sheet.title)
+        rows = sheet.iter_rows(values_only=True)
 
-    #convert the dataframe to an xlsxwriter excel object
-    updated_lib_df.to_excel(writer, sheet_name='Sheet1', index=False)
+        if num > 0:
+            for row in rows:
+                copy.append(row)
+            continue
 
-    #Get the xlsxwriter worksheet object.
-    worksheet = writer.sheets['Sheet1']
+        header = list(next(rows, ()))
+        well_col = header.index('well')
+        vol_col = header.index('Vol (uL) in plate')
 
-    #Use the set of 26 uppercase letters, zero-indexed, to get the excel column
-    #for the right most column in the updated library df
-    r_most_col = string.ascii_uppercase[len(updated_lib_df.columns) - 1]
+        copy.append(header + [col_name])
 
-    #Set an autofilter with no conditions, the saved .xslx file will have the filter
-    #already on. Nice!
-    worksheet.autofilter('A1:{}1'.format(r_most_col)) #can automatically deal with
-                                                      #libraries with columns up to
-                                                      #'Z', no combinatorial 'AB' etc
+        for row in rows:
+            row = list(row) + [None] * (len(header) - len(row))
+            if row[well_col] in new_vols:
+                vol = new_vols[row[well_col]]
+                row[vol_col] = None if pd.isnull(vol) else float(vol)
+            row.append(row[vol_col])
+            copy.append(row)
 
-    #Close the Pandas Excel writer and output the Excel file.
-    writer.save()
+        #autofilter on the header row, get_column_letter goes past 'Z' to 'AA', 'AB', ...
+        copy.auto_filter.ref = 'A1:{}1'.format(get_column_letter(len(header) + 1))
 
-    print('I saved your updated library file as: {}'.format(new_file_name))
+    temp_file = library_file + '.saving'
+    target.save(temp_file)
+    source.close()
+
+    os.replace(temp_file, library_file)
+
+    print('I updated the volumes in your library file: {}, and added the column: {}'.format(library_file, col_name))
+
+    return None
+
+#Write the new volumes over the 'Vol (uL) in plate' column of the library's first sheet (the one that gets read),
+#matching rows up by well. No other cells change and the old volumes live in the history file, but the whole
+#workbook gets loaded and saved again by openpyxl (it keeps the formatting, unlike append_vol_column).
+def write_vols_in_place (updated_lib_df, library_file):
+
+    new_vols = dict(zip(updated_lib_df['well'], updated_lib_df['Vol (uL) in plate']))
+
+    workbook = openpyxl.load_workbook(library_file)
+    worksheet = workbook.worksheets[0]
+
+    header = [cell.value for cell in worksheet[1]]
+    well_col = header.index('well') + 1
+    vol_col = header.index('Vol (uL) in plate') + 1
+
+    for rownum in range(2, worksheet.max_row + 1):
+        well = worksheet.cell(row=rownum, column=well_col).value
+        if well in new_vols:
+            worksheet.cell(row=rownum, column=vol_col).value = None if pd.isnull(new_vols[well]) else float(new_vols[well])
+
+    workbook.save(library_file)
+
+    print('I updated the volumes in your library file: {}'.format(library_file))
 
     return None
 
@@ -258,17 +655,131 @@ def write_to_xlsx (updated_lib_df):
 
 
 
-def main():
-    library_used = pick_parts_library()
-    pl_used = pick_pick_list()
+"""Begin functions for doing a whole update without asking anything"""
+#Total volume taken out of each source well by a run: from the Echo's report if there is one (saving the transfers
+#that didn't go as planned to discrepancy_file), otherwise from the planned pick list
+def used_volumes (pick_list_file, report_file=None, discrepancy_file=None):
+
+    if report_file is None:
+        return read_pick_list_chunked(pick_list_file)
+
+    if discrepancy_file is None:
+        discrepancy_file = os.path.join(os.getcwd(), 'transfer discrepancies.csv')
+
+    reconciled = reconcile_transfers(pick_list_file, report_file)
+    discrepancies = find_discrepancies(reconciled)
+
+    if len(discrepancies):
+        discrepancies.to_csv(discrepancy_file, index=False)
+        print('{} transfers did not go as planned, they are listed in "{}"'.format(len(discrepancies), discrepancy_file))
+
+    return delivered_by_source(reconciled)
+
+#When this pick list (and report) was last taken out of this library, or None if it never was
+def already_used (library_file, pick_list_file, report_file=None):
+
+    return when_recorded(load_history(history_file_for(library_file)), hash_run(pick_list_file, report_file))
+
+#Make sure this pick list (and report) hasn't already been taken out of this library, updating with it twice
+#subtracts its volumes twice. force=True goes ahead anyway, for when the same pick list really was run again.
+#Returns the library's history file and the run's hash for record_update()
+def check_not_already_used (library_file, pick_list_file, report_file=None, force=False):
+
+    history_file = history_file_for(library_file)
+    pl_hash = hash_run(pick_list_file, report_file)
+
+    done = already_used(library_file, pick_list_file, report_file)
+    if done is not None and not force:
+        raise ValueError('***This pick list was already used to update this library on {}, procedure aborted. '\
+                         'If it was run on the Echo again, update with force=True or with the new Echo report***'.format(done))
+
+    return history_file, pl_hash
+
+#Ask whether a pick list that was already used on this library really was run again, the interactive force=True
+def check_run_again (library_file, pick_list_file, report_file=None):
+
+    done = already_used(library_file, pick_list_file, report_file)
+    if done is None:
+        return False
+
+    again = input('This pick list was already used to update this library on {}. Did you run it on the Echo again? (y/n)   '.format(done))
+
+    if again in ['Y', 'y']:
+        return True
+    elif again in ['N', 'n']:
+        raise ValueError('Update procedure aborted, this pick list is already taken out of the library')
+    else:
+        raise ValueError('I do not recognize this input, procedure aborted')
+
+#Subtract the used volumes from the library file, record the change in its history and save the new volumes.
+#vol_column=True also adds a column of the new volumes named with the time of the update (see append_vol_column).
+def apply_update (library_file, library_name, used_vols_df, history_file, pl_hash, vol_column=False):
+
+    library_used = pd.read_excel(library_file)
+
+    #update_lib_vols changes the library it's given, keep the old volumes to work out the changes
+    old_library = library_used.copy()
+
+    #only subtract the transfers that came out of this library's plate
+    updated_library = update_lib_vols (used_vols_df, library_used, library_name)
+
+    #save the library first, if that fails (e.g. the file is open in Excel) nothing gets recorded
+    #and the same pick list can be used again once the file can be saved
+    if vol_column:
+        append_vol_column (updated_library, library_file)
+    else:
+        write_vols_in_place (updated_library, library_file)
+
+    record_update(old_library, updated_library, history_file, pl_hash)
+
+    return updated_library
+
+#The whole update for one library and one completed pick list (and the Echo's report, if there is one) with no
+#questions asked, for running from other scripts. The library name defaults to its file name, like the finders use.
+#force=True updates even if this pick list was used on the library before.
+def update_library_file (library_file, pick_list_file, report_file=None, library_name=None, discrepancy_file=None, vol_column=False, force=False):
+
+    if library_name is None:
+        library_name = os.path.splitext(os.path.basename(library_file))[0]
+
+    history_file, pl_hash = check_not_already_used(library_file, pick_list_file, report_file, force)
+
+    used_vols = used_volumes(pick_list_file, report_file, discrepancy_file)
+
+    return apply_update(library_file, library_name, used_vols, history_file, pl_hash, vol_column)
+"""end functions for doing a whole update without asking anything"""
+
+
+
+def main(vol_column=False):
+    """vol_column=True keeps a record of the volumes in the library file too, by adding a
+    column of the new volumes named with the time of the update"""
+
+    library_path, library_name = choose_parts_library()
+    print ("===================================")
+
+    pl_path = choose_pick_list()
+    print ("===================================")
+
+    #if the Echo's report of the run is around, only subtract what was really shot
+    report_path = choose_transfer_report()
+
+    #check on a repeated pick list and get the go-ahead before reading anything or writing the discrepancy file,
+    #so an aborted run leaves the last run's "transfer discrepancies.csv" alone
+    again = check_run_again(library_path, pl_path, report_path)
+    history_file, pl_hash = check_not_already_used(library_path, pl_path, report_path, force=again)
 
     check_before_update()
 
-    updated_library = update_lib_vols (pl_used, library_used)
+    pl_used = used_volumes(pl_path, report_path)
 
-    write_to_xlsx (updated_library)
+    apply_update(library_path, library_name, pl_used, history_file, pl_hash, vol_column)
 
     return None
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Take a pick list that was run on the Echo out of a parts library, everything else gets asked as it goes')
+    parser.add_argument('--vol-column', action='store_true', help='also keep the new volumes as a column named with the time of the update')
+    args = parser.parse_args()
+
+    main(args.vol_column)